@@ -1,10 +1,25 @@
+import hashlib
 import os
-import json
 import sqlite3
-from flask import Flask, request, jsonify
+import threading
+from abc import ABC, abstractmethod
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from functools import lru_cache
+from urllib.parse import quote
+from flask import Flask, request
 from dotenv import load_dotenv
 from apify_client import ApifyClient
 from apify_client.errors import ApifyClientError
+import orjson
+import zstandard
+from cachetools import TTLCache
+from pydantic import BaseModel, Field, ValidationError
+import redis
+import psycopg2
+import psycopg2.extensions
+import psycopg2.extras
+import psycopg2.pool
 
 # 1. Cargar Variables de Entorno
 load_dotenv()
@@ -16,6 +31,19 @@ APIFY_TOKEN = os.getenv("APIFY_TOKEN")
 TECDOC_ACTOR_ID = os.getenv("TECDOC_ACTOR_ID", "making-data-meaningful/tecdoc")
 SQLITE_DB_PATH = os.getenv("SQLITE_DB_PATH", "cache.db")
 
+# Backend de caché: "postgres" (por defecto), "sqlite" o "memory" (tests)
+CACHE_BACKEND = os.getenv("CACHE_BACKEND", "postgres")
+
+POSTGRES_HOST = os.getenv("POSTGRES_HOST", "localhost")
+POSTGRES_PORT = os.getenv("POSTGRES_PORT", "5432")
+POSTGRES_DB = os.getenv("POSTGRES_DB", "tecdoc_cache")
+POSTGRES_USER = os.getenv("POSTGRES_USER", "postgres")
+POSTGRES_PASSWORD = os.getenv("POSTGRES_PASSWORD", "")
+
+# Redis como L1 opcional delante de la base de datos (p.ej.
+# "unix:///tmp/redis.sock" o "redis://localhost:6379/0"); vacío = desactivado
+REDIS_URL = os.getenv("REDIS_URL", "")
+
 # Inicializar el cliente de Apify
 if APIFY_TOKEN:
     apify_client = ApifyClient(APIFY_TOKEN)
@@ -23,101 +51,679 @@ else:
     print("FATAL: APIFY_TOKEN no configurado.")
     # Si la clave es esencial, podrías terminar la aplicación aquí.
 
-# --- Funciones de Base de Datos SQLite ---
+# --- Claves de Caché ---
 
-def get_db_connection():
-    """Establece y devuelve una conexión a la base de datos SQLite."""
-    try:
-        # La conexión es thread-safe en Flask si se usa el mismo hilo de request.
-        conn = sqlite3.connect(SQLITE_DB_PATH)
-        # Permite acceder a las columnas por nombre
-        conn.row_factory = sqlite3.Row 
-        return conn
-    except Exception as e:
-        print(f"Error al conectar a la base de datos SQLite: {e}")
-        return None
+def create_cache_key(make, model, year):
+    """Genera una clave estandarizada para el cacheo."""
+    return f"{make.strip()}_{model.strip()}_{year}".upper()
 
-def initialize_db():
-    """Crea la tabla 'vehicle_cache' si no existe."""
-    conn = get_db_connection()
-    if not conn:
-        return
+@lru_cache(maxsize=8192)
+def key_of(make, model, year):
+    """Versión memorizada de create_cache_key para las consultas repetidas."""
+    return create_cache_key(make, model, str(year))
 
-    try:
+def hash_cache_key(cache_key):
+    """Reduce la clave legible a un digest blake2b de 16 bytes.
+
+    La PK pasa de VARCHAR variable a 16 bytes fijos: el B-tree encaja más
+    entradas por página y las comparaciones son más baratas. La clave legible
+    se conserva en una columna aparte para depuración.
+    """
+    return hashlib.blake2b(cache_key.encode(), digest_size=16).digest()
+
+# --- Backends de Caché ---
+
+def _jsonb(data):
+    """Adaptador Json de psycopg2 con orjson como serializador.
+
+    Deja que psycopg2 adapte el valor como JSON nativo en lugar de pasar un
+    string suelto, manteniendo la serialización en el camino rápido de orjson.
+    """
+    return psycopg2.extras.Json(data, dumps=lambda obj: orjson.dumps(obj).decode())
+
+class CacheBackend(ABC):
+    """Interfaz común de los backends de caché (clave legible -> texto JSON)."""
+
+    @abstractmethod
+    def initialize(self):
+        """Crea el esquema necesario (idempotente)."""
+
+    @abstractmethod
+    def check(self, cache_key):
+        """Devuelve el payload como texto JSON, o None si no está cacheado."""
+
+    @abstractmethod
+    def check_many(self, cache_keys):
+        """Resuelve un lote de claves en una sola consulta; dict clave -> texto."""
+
+    @abstractmethod
+    def save(self, cache_key, data):
+        """Guarda el payload y devuelve el texto JSON almacenado (o None)."""
+
+    def save_many(self, items):
+        """Guarda un lote de pares (cache_key, data); devuelve cuántos entraron.
+
+        Implementación de referencia fila a fila; los backends SQL la
+        sustituyen por una carga por lotes.
+        """
+        saved = 0
+        for cache_key, data in items:
+            if self.save(cache_key, data) is not None:
+                saved += 1
+        return saved
+
+    def find_by_containment(self, filter_dict):
+        """Filtra por contención JSON; solo Postgres lo soporta."""
+        return []
+
+class PreparedConnection(psycopg2.extensions.connection):
+    """Conexión que recuerda si sus sentencias ya están preparadas.
+
+    La marca vive en el propio objeto: cuando el pool descarta una conexión
+    muerta (reinicio de Postgres, timeout) y marca una de reemplazo, la nueva
+    empieza sin preparar. Rastrearlo fuera de la conexión por id(conn) era
+    incorrecto: CPython reutiliza direcciones liberadas y la conexión nueva
+    se saltaba el PREPARE.
+    """
+    statements_prepared = False
+
+class PostgresBackend(CacheBackend):
+    """Caché sobre PostgreSQL: pool de conexiones, JSONB y sentencias preparadas."""
+
+    def __init__(self, host, port, dbname, user, password):
+        # Pool a nivel de proceso: evita el handshake TCP+auth completo en
+        # cada request. Las conexiones se reutilizan entre peticiones.
+        self.pool = None
+        try:
+            self.pool = psycopg2.pool.ThreadedConnectionPool(
+                2, 20,
+                host=host,
+                port=port,
+                dbname=dbname,
+                user=user,
+                password=password,
+                connection_factory=PreparedConnection,
+            )
+        except Exception as e:
+            print(f"Error al crear el pool de conexiones a PostgreSQL: {e}")
+
+    @contextmanager
+    def _db_conn(self):
+        """Presta una conexión del pool y la devuelve al terminar."""
+        conn = self.pool.getconn()
+        # autocommit evita el BEGIN/COMMIT implícito en cada SELECT del hit.
+        conn.autocommit = True
+        try:
+            yield conn
+        finally:
+            self.pool.putconn(conn)
+
+    def _ensure_prepared(self, conn):
+        """Prepara las sentencias calientes una sola vez por conexión.
+
+        PREPARE guarda el plan en el servidor, así que las ejecuciones
+        siguientes se ahorran el parse+plan de cada consulta.
+        """
+        if conn.statements_prepared:
+            return
         cur = conn.cursor()
-        # Usamos TEXT para el 'data' y guardamos la representación JSON como string.
         cur.execute("""
-            CREATE TABLE IF NOT EXISTS vehicle_cache (
-                cache_key TEXT PRIMARY KEY, 
-                data TEXT NOT NULL,
-                retrieved_at DATETIME DEFAULT CURRENT_TIMESTAMP
-            );
+            PREPARE vc_get(bytea) AS
+                SELECT data::text FROM vehicle_cache WHERE cache_key = $1;
+            PREPARE vc_put(bytea, text, jsonb) AS
+                INSERT INTO vehicle_cache (cache_key, cache_key_text, data, retrieved_at)
+                VALUES ($1, $2, $3, now())
+                ON CONFLICT (cache_key)
+                DO UPDATE SET data = EXCLUDED.data, retrieved_at = now()
+                RETURNING data::text;
         """)
-        conn.commit()
-        print(f"✅ DB inicializada en: {SQLITE_DB_PATH}")
-    except Exception as e:
-        print(f"Error al inicializar la DB SQLite: {e}")
-    finally:
-        if conn:
-            conn.close()
+        conn.statements_prepared = True
 
-# Inicializar la base de datos al inicio de la aplicación
-initialize_db()
+    def initialize(self):
+        """Crea la tabla 'vehicle_cache' en PostgreSQL si no existe."""
+        if not self.pool:
+            return
 
-# --- Funciones de Lógica de Caching ---
+        try:
+            with self._db_conn() as conn:
+                cur = conn.cursor()
+                # Todas las sentencias viajan en un solo round-trip. Ojo: los
+                # comentarios dentro del SQL deben ser '--' (el '#' de Python
+                # no es sintaxis válida en Postgres).
+                cur.execute("""
+                    CREATE TABLE IF NOT EXISTS vehicle_cache (
+                        -- Digest blake2b (16 bytes) de la clave legible: PK de
+                        -- ancho fijo, B-tree mucho más compacto que VARCHAR
+                        cache_key BYTEA PRIMARY KEY,
+                        -- Clave legible (MARCA_MODELO_AÑO), solo para depuración
+                        cache_key_text VARCHAR(255) NOT NULL,
+                        -- Payload completo devuelto por Apify
+                        data JSONB NOT NULL,
+                        retrieved_at TIMESTAMPTZ DEFAULT now()
+                    )
+                    -- fillfactor < 100 deja hueco en cada página para que los
+                    -- upserts sean HOT updates (sin tocar índices); el
+                    -- autovacuum más agresivo contiene las tuplas muertas que
+                    -- genera ON CONFLICT DO UPDATE.
+                    WITH (fillfactor = 70, autovacuum_vacuum_scale_factor = 0.05);
 
-def create_cache_key(make, model, year):
-    """Genera una clave estandarizada para el cacheo."""
-    return f"{make.strip()}_{model.strip()}_{year}".upper()
+                    -- Idempotente: aplica los mismos parámetros si la tabla ya
+                    -- existía de un despliegue anterior.
+                    ALTER TABLE vehicle_cache
+                        SET (fillfactor = 70, autovacuum_vacuum_scale_factor = 0.05);
+                    ALTER INDEX vehicle_cache_pkey SET (fillfactor = 70);
 
-def check_cache(cache_key):
-    """Busca los datos del vehículo en la base de datos local."""
-    conn = get_db_connection()
-    if not conn:
-        return None
+                    -- Índice GIN con jsonb_path_ops: permite filtros de
+                    -- contención (@>) con bitmap index scan en lugar de seq
+                    -- scan, y ocupa bastante menos que jsonb_ops.
+                    CREATE INDEX IF NOT EXISTS vehicle_cache_data_gin
+                    ON vehicle_cache USING GIN (data jsonb_path_ops);
+                """)
+                # lz4 para TOAST (Postgres 14+): el pglz por defecto comprime
+                # poco y descomprime lento. Si el servidor no lo soporta, se
+                # ignora.
+                try:
+                    cur.execute("ALTER TABLE vehicle_cache ALTER COLUMN data SET COMPRESSION lz4;")
+                except Exception as e:
+                    print(f"Aviso: sin compresión lz4 para 'data': {e}")
+            print("✅ DB PostgreSQL inicializada.")
+        except Exception as e:
+            print(f"Error al inicializar la DB PostgreSQL: {e}")
 
-    try:
-        cur = conn.cursor()
-        cur.execute("SELECT data FROM vehicle_cache WHERE cache_key = ?", (cache_key,))
-        result = cur.fetchone()
-        
-        if result:
+    def check(self, cache_key):
+        """Busca el vehículo en PostgreSQL y devuelve el JSON como texto."""
+        if not self.pool:
+            return None
+
+        try:
+            with self._db_conn() as conn:
+                self._ensure_prepared(conn)
+                cur = conn.cursor()
+                cur.execute("EXECUTE vc_get(%s)", (hash_cache_key(cache_key),))
+                result = cur.fetchone()
+
+            if result:
+                print(f"✅ Cache Hit para: {cache_key}")
+                # data::text evita que psycopg2 deserialice el JSONB a dict
+                # solo para volver a serializarlo en la respuesta
+                return result[0]
+            else:
+                print(f"❌ Cache Miss para: {cache_key}")
+                return None
+        except Exception as e:
+            print(f"Error al consultar la caché: {e}")
+            return None
+
+    def check_many(self, cache_keys):
+        """Busca varias claves en PostgreSQL en un solo round-trip."""
+        if not self.pool:
+            return {}
+
+        try:
+            with self._db_conn() as conn:
+                cur = conn.cursor()
+                # psycopg2 adapta la lista de Python a un array de Postgres
+                cur.execute(
+                    "SELECT cache_key_text, data::text FROM vehicle_cache WHERE cache_key = ANY(%s)",
+                    ([hash_cache_key(k) for k in cache_keys],)
+                )
+                return dict(cur.fetchall())
+        except Exception as e:
+            print(f"Error al consultar la caché: {e}")
+            return {}
+
+    def save(self, cache_key, data):
+        """Guarda o actualiza los datos en PostgreSQL.
+
+        Devuelve el texto JSON canónico que quedó almacenado: el RETURNING del
+        upsert lo trae en el mismo round-trip, sin una consulta extra.
+        """
+        if not self.pool:
+            return None
+
+        try:
+            with self._db_conn() as conn:
+                self._ensure_prepared(conn)
+                cur = conn.cursor()
+                cur.execute(
+                    "EXECUTE vc_put(%s, %s, %s)",
+                    (hash_cache_key(cache_key), cache_key, _jsonb(data))
+                )
+                stored = cur.fetchone()
+            print(f"💾 Datos guardados en caché para: {cache_key}")
+            return stored[0] if stored else None
+        except Exception as e:
+            print(f"Error al guardar en caché: {e}")
+            return None
+
+    def save_many(self, items):
+        """Carga masiva de pares (cache_key, data) con execute_values.
+
+        Una sola sentencia con la lista VALUES paginada (500 filas por viaje)
+        en lugar de un INSERT por fila: pensado para warm-ups y resiembras,
+        donde la versión fila a fila paga N round-trips.
+        """
+        if not self.pool or not items:
+            return 0
+
+        try:
+            rows = [
+                (hash_cache_key(cache_key), cache_key, _jsonb(data))
+                for cache_key, data in items
+            ]
+            with self._db_conn() as conn:
+                cur = conn.cursor()
+                psycopg2.extras.execute_values(
+                    cur,
+                    """
+                    INSERT INTO vehicle_cache (cache_key, cache_key_text, data, retrieved_at)
+                    VALUES %s
+                    ON CONFLICT (cache_key)
+                    DO UPDATE SET data = EXCLUDED.data, retrieved_at = now()
+                    """,
+                    rows,
+                    template="(%s, %s, %s, now())",
+                    page_size=500,
+                )
+            print(f"💾 {len(rows)} entradas guardadas en caché.")
+            return len(rows)
+        except Exception as e:
+            print(f"Error al guardar en caché: {e}")
+            return 0
+
+    def find_by_containment(self, filter_dict):
+        """Busca entradas cuyo JSON contenga el filtro dado (operador @>).
+
+        Usa el índice GIN jsonb_path_ops, así que la búsqueda es un bitmap
+        index scan en lugar de recorrer toda la tabla. Devuelve una lista de
+        tuplas (cache_key_text, data).
+        """
+        if not self.pool:
+            return []
+
+        try:
+            with self._db_conn() as conn:
+                cur = conn.cursor()
+                cur.execute(
+                    "SELECT cache_key_text, data FROM vehicle_cache WHERE data @> %s::jsonb",
+                    (orjson.dumps(filter_dict).decode(),)
+                )
+                return cur.fetchall()
+        except Exception as e:
+            print(f"Error en la búsqueda por contención: {e}")
+            return []
+
+# SQLite no comprime nada por sí mismo (Postgres lo hace vía TOAST), así que
+# los payloads grandes se guardan como BLOB zstd con un byte de marca delante.
+# Las filas TEXT antiguas y las pequeñas siguen leyéndose tal cual.
+_ZSTD_MIN_SIZE = 16 * 1024
+_ZSTD_FLAG = b"\x01"
+
+class SQLiteBackend(CacheBackend):
+    """Caché sobre SQLite: una conexión WAL persistente por proceso.
+
+    Abrir sqlite3.connect() en cada request pagaba open+parse del esquema
+    cada vez. Las escrituras se serializan con un lock; en modo WAL los
+    lectores no bloquean al escritor.
+    """
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self._conn = None
+        self._lock = threading.Lock()
+
+    def _get_connection(self):
+        """Devuelve la conexión SQLite persistente (creándola si falta)."""
+        if self._conn is not None:
+            return self._conn
+
+        with self._lock:
+            if self._conn is not None:
+                return self._conn
+            try:
+                conn = sqlite3.connect(
+                    self.db_path, check_same_thread=False, isolation_level=None
+                )
+                # Permite acceder a las columnas por nombre
+                conn.row_factory = sqlite3.Row
+                # WAL: lectores y un escritor concurrentes, menos fsync
+                conn.execute("PRAGMA journal_mode=WAL")
+                conn.execute("PRAGMA synchronous=NORMAL")
+                conn.execute("PRAGMA mmap_size=268435456")
+                conn.execute("PRAGMA cache_size=-65536")
+                self._conn = conn
+                return conn
+            except Exception as e:
+                print(f"Error al conectar a la base de datos SQLite: {e}")
+                return None
+
+    @staticmethod
+    def _encode_data(data_json):
+        """Comprime los payloads grandes con zstd antes de guardarlos."""
+        if len(data_json) < _ZSTD_MIN_SIZE:
+            return data_json
+        return _ZSTD_FLAG + zstandard.ZstdCompressor(level=6).compress(data_json.encode())
+
+    @staticmethod
+    def _decode_data(stored):
+        """Devuelve el texto JSON almacenado, descomprimiendo si hace falta."""
+        if isinstance(stored, bytes):
+            if stored[:1] == _ZSTD_FLAG:
+                return zstandard.ZstdDecompressor().decompress(stored[1:]).decode()
+            return stored.decode()
+        return stored
+
+    def initialize(self):
+        """Crea la tabla 'vehicle_cache' si no existe."""
+        conn = self._get_connection()
+        if not conn:
+            return
+
+        try:
+            cur = conn.cursor()
+            # Usamos TEXT para el 'data' y guardamos la representación JSON
+            # como string; la PK es el digest de 16 bytes de la clave legible.
+            cur.execute("""
+                CREATE TABLE IF NOT EXISTS vehicle_cache (
+                    cache_key BLOB PRIMARY KEY,
+                    cache_key_text TEXT NOT NULL,
+                    data TEXT NOT NULL,
+                    retrieved_at DATETIME DEFAULT CURRENT_TIMESTAMP
+                );
+            """)
+            print(f"✅ DB inicializada en: {self.db_path}")
+        except Exception as e:
+            print(f"Error al inicializar la DB SQLite: {e}")
+
+    def check(self, cache_key):
+        """Busca el vehículo en SQLite y devuelve el JSON como texto."""
+        conn = self._get_connection()
+        if not conn:
+            return None
+
+        try:
+            cur = conn.cursor()
+            cur.execute(
+                "SELECT data FROM vehicle_cache WHERE cache_key = ?",
+                (hash_cache_key(cache_key),)
+            )
+            result = cur.fetchone()
+
+            if result:
+                print(f"✅ Cache Hit para: {cache_key}")
+                # Lo almacenado ya es JSON serializado: sin parse en Python
+                return self._decode_data(result['data'])
+            else:
+                print(f"❌ Cache Miss para: {cache_key}")
+                return None
+        except Exception as e:
+            print(f"Error al consultar la caché: {e}")
+            return None
+
+    def check_many(self, cache_keys):
+        """Busca varias claves en SQLite en una sola consulta."""
+        conn = self._get_connection()
+        if not conn:
+            return {}
+
+        try:
+            cur = conn.cursor()
+            placeholders = ",".join("?" * len(cache_keys))
+            cur.execute(
+                f"SELECT cache_key_text, data FROM vehicle_cache WHERE cache_key IN ({placeholders})",
+                [hash_cache_key(k) for k in cache_keys]
+            )
+            return {
+                row['cache_key_text']: self._decode_data(row['data'])
+                for row in cur.fetchall()
+            }
+        except Exception as e:
+            print(f"Error al consultar la caché: {e}")
+            return {}
+
+    def save(self, cache_key, data):
+        """Guarda o actualiza los datos y devuelve el texto JSON almacenado."""
+        conn = self._get_connection()
+        if not conn:
+            return None
+
+        try:
+            # Serializar el objeto Python a string JSON
+            data_json = orjson.dumps(data).decode()
+
+            # Insertar o actualizar. SQLite usa REPLACE INTO para esta lógica.
+            # El lock serializa a los escritores del proceso.
+            with self._lock:
+                conn.execute(
+                    """
+                    INSERT OR REPLACE INTO vehicle_cache (cache_key, cache_key_text, data, retrieved_at)
+                    VALUES (?, ?, ?, CURRENT_TIMESTAMP);
+                    """,
+                    (hash_cache_key(cache_key), cache_key, self._encode_data(data_json))
+                )
+            print(f"💾 Datos guardados en caché para: {cache_key}")
+            return data_json
+        except Exception as e:
+            print(f"Error al guardar en caché: {e}")
+            return None
+
+    def save_many(self, items):
+        """Carga masiva con executemany dentro de una sola transacción."""
+        conn = self._get_connection()
+        if not conn or not items:
+            return 0
+
+        try:
+            rows = []
+            for cache_key, data in items:
+                data_json = orjson.dumps(data).decode()
+                rows.append(
+                    (hash_cache_key(cache_key), cache_key, self._encode_data(data_json))
+                )
+            # Una transacción explícita: un solo fsync para todo el lote en
+            # lugar de uno por fila.
+            with self._lock:
+                conn.execute("BEGIN")
+                try:
+                    conn.executemany(
+                        """
+                        INSERT OR REPLACE INTO vehicle_cache (cache_key, cache_key_text, data, retrieved_at)
+                        VALUES (?, ?, ?, CURRENT_TIMESTAMP);
+                        """,
+                        rows
+                    )
+                    conn.execute("COMMIT")
+                except Exception:
+                    conn.execute("ROLLBACK")
+                    raise
+            print(f"💾 {len(rows)} entradas guardadas en caché.")
+            return len(rows)
+        except Exception as e:
+            print(f"Error al guardar en caché: {e}")
+            return 0
+
+class MemoryBackend(CacheBackend):
+    """Caché en memoria pura, sin persistencia. Pensado para tests."""
+
+    def __init__(self):
+        self._store = {}
+        self._lock = threading.Lock()
+
+    def initialize(self):
+        pass
+
+    def check(self, cache_key):
+        with self._lock:
+            result = self._store.get(cache_key)
+        if result is not None:
             print(f"✅ Cache Hit para: {cache_key}")
-            # Deserializar el string JSON a un objeto Python
-            return json.loads(result['data']) 
         else:
             print(f"❌ Cache Miss para: {cache_key}")
-            return None
-    finally:
-        if conn:
-            conn.close()
+        return result
 
-def save_to_cache(cache_key, data):
-    """Guarda o actualiza los datos en la base de datos."""
-    conn = get_db_connection()
-    if not conn:
-        return
+    def check_many(self, cache_keys):
+        with self._lock:
+            return {k: self._store[k] for k in cache_keys if k in self._store}
 
-    try:
-        cur = conn.cursor()
-        # Serializar el objeto Python a string JSON
-        data_json = json.dumps(data) 
-        
-        # Insertar o actualizar. SQLite usa REPLACE INTO para esta lógica.
-        cur.execute(
-            """
-            INSERT OR REPLACE INTO vehicle_cache (cache_key, data, retrieved_at) 
-            VALUES (?, ?, CURRENT_TIMESTAMP);
-            """,
-            (cache_key, data_json)
-        )
-        conn.commit()
+    def save(self, cache_key, data):
+        data_json = orjson.dumps(data).decode()
+        with self._lock:
+            self._store[cache_key] = data_json
         print(f"💾 Datos guardados en caché para: {cache_key}")
+        return data_json
+
+def _create_backend():
+    """Instancia el backend configurado en CACHE_BACKEND."""
+    if CACHE_BACKEND == "sqlite":
+        return SQLiteBackend(SQLITE_DB_PATH)
+    if CACHE_BACKEND == "memory":
+        return MemoryBackend()
+    return PostgresBackend(
+        host=POSTGRES_HOST,
+        port=POSTGRES_PORT,
+        dbname=POSTGRES_DB,
+        user=POSTGRES_USER,
+        password=POSTGRES_PASSWORD,
+    )
+
+# Un solo backend por proceso: un único pool/conexión y un único esquema
+backend = _create_backend()
+
+def initialize_db():
+    """Inicializa el esquema del backend activo."""
+    backend.initialize()
+
+def find_by_containment(filter_dict):
+    """Atajo a la búsqueda por contención del backend activo."""
+    return backend.find_by_containment(filter_dict)
+
+# --- Capa de Caché Local ---
+
+# Caché local en proceso delante de la base de datos: los vehículos más
+# consultados por este worker ni siquiera tocan la DB.
+_local_cache = TTLCache(maxsize=10_000, ttl=300)
+_local_lock = threading.Lock()
+
+# Redis como L1 compartida entre workers: un GET es ~10x más barato que un
+# PK lookup en Postgres y descarga a la DB de casi todas las lecturas.
+# Se guarda el texto JSON ya serializado, así el camino caliente no hace
+# ningún trabajo de JSON.
+_redis = None
+if REDIS_URL:
+    try:
+        _redis = redis.Redis.from_url(REDIS_URL, decode_responses=False)
+        _redis.ping()
+        print("✅ Redis conectado como caché L1.")
     except Exception as e:
-        print(f"Error al guardar en caché: {e}")
-    finally:
-        if conn:
-            conn.close()
+        print(f"Error al conectar a Redis (se sigue sin L1): {e}")
+        _redis = None
+
+REDIS_TTL_SECONDS = 86400
+
+def _redis_get(cache_key):
+    """Lee una clave de Redis; los errores degradan a miss."""
+    if _redis is None:
+        return None
+    try:
+        value = _redis.get(cache_key)
+        return value.decode() if value is not None else None
+    except Exception as e:
+        print(f"Error al leer de Redis: {e}")
+        return None
+
+def _redis_set(cache_key, data_text):
+    """Escribe una clave en Redis con TTL; los errores solo se registran."""
+    if _redis is None:
+        return
+    try:
+        _redis.setex(cache_key, REDIS_TTL_SECONDS, data_text.encode())
+    except Exception as e:
+        print(f"Error al escribir en Redis: {e}")
+
+def check_cache(cache_key):
+    """Busca en la caché local y, si no está, en la base de datos.
+
+    Devuelve el payload como texto JSON ya serializado: el camino caliente
+    nunca materializa el dict en Python.
+    """
+    with _local_lock:
+        cached = _local_cache.get(cache_key)
+    if cached is not None:
+        print(f"⚡ Cache Hit local para: {cache_key}")
+        return cached
+
+    cached = _redis_get(cache_key)
+    if cached is not None:
+        print(f"⚡ Cache Hit Redis para: {cache_key}")
+        with _local_lock:
+            _local_cache[cache_key] = cached
+        return cached
+
+    result = backend.check(cache_key)
+    if result is not None:
+        _redis_set(cache_key, result)
+        with _local_lock:
+            _local_cache[cache_key] = result
+    return result
+
+def check_cache_many(cache_keys):
+    """Resuelve un lote de claves con una sola consulta a la base de datos.
+
+    Devuelve un dict cache_key -> texto JSON solo con las claves encontradas.
+    """
+    found = {}
+    missing = []
+    with _local_lock:
+        for key in cache_keys:
+            cached = _local_cache.get(key)
+            if cached is not None:
+                found[key] = cached
+            else:
+                missing.append(key)
+
+    if missing and _redis is not None:
+        try:
+            for key, value in zip(missing, _redis.mget(missing)):
+                if value is not None:
+                    found[key] = value.decode()
+            missing = [k for k in missing if k not in found]
+            with _local_lock:
+                _local_cache.update({k: found[k] for k in found})
+        except Exception as e:
+            print(f"Error al leer de Redis: {e}")
+
+    if missing:
+        db_found = backend.check_many(missing)
+        for key, data_text in db_found.items():
+            _redis_set(key, data_text)
+        with _local_lock:
+            _local_cache.update(db_found)
+        found.update(db_found)
+    return found
+
+def save_to_cache(cache_key, data):
+    """Guarda en la base de datos y escribe también en la caché local."""
+    # El backend devuelve el texto canónico almacenado (RETURNING en Postgres),
+    # así que la escritura local no paga una segunda serialización.
+    stored = backend.save(cache_key, data)
+    if stored is None:
+        stored = orjson.dumps(data).decode()
+    _redis_set(cache_key, stored)
+    with _local_lock:
+        _local_cache[cache_key] = stored
+
+def save_many_to_cache(items):
+    """Carga masiva de pares (cache_key, data), para warm-ups y resiembras."""
+    return backend.save_many(items)
+
+# Las migraciones se ejecutan fuera de banda (python manage.py migrate) o en
+# el arranque si RUN_MIGRATIONS=1. Sin la variable, cada worker se ahorra el
+# round-trip de CREATE TABLE al importar el módulo (también en tests, flask
+# shell y scripts), y los despliegues no provocan una estampida de DDL.
+if os.getenv("RUN_MIGRATIONS") == "1":
+    initialize_db()
+
+# --- Funciones de Lógica de Caching ---
 
 def call_apify_api(make, model, year):
     """Llama al Actor de Apify para obtener los datos del vehículo."""
@@ -133,15 +739,21 @@ def call_apify_api(make, model, year):
         run = apify_client.actor(TECDOC_ACTOR_ID).call(run_input=run_input, timeout_secs=600)
 
         if run and run.get('defaultDatasetId'):
-            dataset_items = apify_client.dataset(run['defaultDatasetId']).list_items().items
-            
+            # iterate_items() pagina el dataset bajo demanda en lugar de
+            # descargarlo entero en una sola respuesta HTTP: la transferencia
+            # y el parse van por páginas, aunque la lista final sigue
+            # conteniendo el dataset completo (la caché guarda una sola fila).
+            dataset_items = []
+            for item in apify_client.dataset(run['defaultDatasetId']).iterate_items():
+                dataset_items.append(item)
+
             if dataset_items:
                 print(f"🎉 API Success: {len(dataset_items)} ítems encontrados.")
                 return dataset_items
             else:
                 print("API Success: Dataset vacío.")
                 return []
-        
+
         return []
 
     except ApifyClientError as e:
@@ -151,63 +763,242 @@ def call_apify_api(make, model, year):
         print(f"Error general al llamar a Apify: {e}")
         return None
 
+# --- Trabajos en segundo plano para Cache Misses ---
+
+# Un miss ya no bloquea el worker de Flask hasta 600s: la llamada a Apify se
+# encola en un pool de hilos y el cliente consulta el estado por job_id.
+_apify_executor = ThreadPoolExecutor(max_workers=int(os.getenv("APIFY_WORKERS", "4")))
+# Los trabajos terminados expiran solos para que el registro no crezca sin límite.
+_jobs = TTLCache(maxsize=10_000, ttl=3600)
+_inflight_keys = set()  # cache_keys con job en vuelo en ESTE proceso
+_jobs_lock = threading.Lock()
+
+# Gunicorn corre varios workers (ver Dockerfile) y cada uno tiene su propio
+# registro de jobs: el marcador SET NX en Redis evita que el mismo miss
+# dispare una ejecución (de pago) del Actor por cada worker.
+_INFLIGHT_TTL_SECONDS = 900
+
+def _inflight_redis_key(cache_key):
+    return "apify_inflight:" + cache_key
+
+def _try_claim_job(cache_key):
+    """Intenta reclamar el job entre workers (SET NX con TTL en Redis).
+
+    Sin Redis configurado no hay estado compartido y cada worker reclama
+    siempre: la deduplicación queda limitada al proceso, como antes.
+    """
+    if _redis is None:
+        return True
+    try:
+        return bool(_redis.set(_inflight_redis_key(cache_key), b"1",
+                               nx=True, ex=_INFLIGHT_TTL_SECONDS))
+    except Exception as e:
+        print(f"Error en Redis al reclamar el job (se encola local): {e}")
+        return True
+
+def _release_job(cache_key):
+    if _redis is None:
+        return
+    try:
+        _redis.delete(_inflight_redis_key(cache_key))
+    except Exception as e:
+        print(f"Error en Redis al liberar el job: {e}")
+
+def _run_apify_job(cache_key, make, model, year_str):
+    """Ejecuta la llamada a Apify y guarda el resultado en caché."""
+    try:
+        data = call_apify_api(make, model, year_str)
+        if data:
+            save_to_cache(cache_key, data)
+        return data
+    finally:
+        with _jobs_lock:
+            _inflight_keys.discard(cache_key)
+        _release_job(cache_key)
+
+def enqueue_apify_job(cache_key, make, model, year_str):
+    """Encola la llamada a Apify y devuelve el job_id (reutiliza el job en vuelo).
+
+    El job_id es la propia cache_key: así /vehicle-data/status/<job_id>
+    puede resolverse desde cualquier worker de gunicorn vía la caché
+    compartida, aunque el Future viva solo en el proceso que encoló el job.
+    """
+    with _jobs_lock:
+        if cache_key in _inflight_keys:
+            return cache_key
+        if _try_claim_job(cache_key):
+            _inflight_keys.add(cache_key)
+            _jobs[cache_key] = _apify_executor.submit(
+                _run_apify_job, cache_key, make, model, year_str
+            )
+        # Si otro worker ya reclamó el job no se encola nada aquí: el
+        # cliente sigue el status_url y lo resuelve la caché compartida.
+        return cache_key
+
 # --- Endpoint de la API Web (Flask) ---
 
+class VehicleQuery(BaseModel):
+    """Parámetros validados de una consulta de vehículo.
+
+    pydantic v2 valida en Rust (pydantic-core), bastante más rápido que los
+    chequeos manuales con all() + int() por request.
+    """
+    make: str = Field(min_length=1)
+    model: str = Field(min_length=1)
+    year: int = Field(ge=1900, le=2100)
+
+# Tope de consultas por petición de lote
+MAX_BATCH_QUERIES = 50
+
+def json_response(payload, status=200):
+    """Serializa la respuesta con orjson, evitando el jsonify de Flask."""
+    return app.response_class(orjson.dumps(payload), status=status,
+                              mimetype="application/json")
+
+def cached_body_response(body):
+    """Respuesta de cache hit con ETag fuerte sobre el cuerpo ya serializado.
+
+    El ETag permite 304 Not Modified a clientes e intermediarios (y
+    micro-caching en nginx), así que los hits repetidos ni siquiera
+    reenvían el payload por la red.
+    """
+    resp = app.response_class(body, mimetype="application/json")
+    resp.set_etag(hashlib.blake2b(body, digest_size=16).hexdigest())
+    return resp.make_conditional(request)
+
 @app.route('/vehicle-data', methods=['GET'])
 def get_vehicle_data():
     """
     Endpoint: /vehicle-data?make=AUDI&model=A4&year=2020
     Realiza la búsqueda con la lógica de Caching.
     """
-    
-    make = request.args.get('make')
-    model = request.args.get('model')
-    year_str = request.args.get('year')
-
-    if not all([make, model, year_str]):
-        return jsonify({"error": "Faltan parámetros. Se requiere 'make', 'model' y 'year'."}), 400
-    
+
     try:
-        # Validación simple del año
-        year = int(year_str) 
-    except ValueError:
-        return jsonify({"error": "El parámetro 'year' debe ser un número entero válido."}), 400
+        q = VehicleQuery.model_validate(request.args.to_dict())
+    except ValidationError:
+        return json_response({"error": "Parámetros inválidos. Se requiere 'make', 'model' y 'year' (entero)."}, 400)
 
-    cache_key = create_cache_key(make, model, year_str)
+    make, model, year_str = q.make, q.model, str(q.year)
+    cache_key = key_of(q.make, q.model, q.year)
 
     # 1. Verificar Cache
     cached_data = check_cache(cache_key)
-    
+
     if cached_data:
-        # Retornar datos cacheados
-        return jsonify({
-            "source": "cache",
-            "message": "Datos recuperados de la base de datos local (Cache Hit).",
+        # cached_data ya es texto JSON: se incrusta tal cual en el cuerpo de
+        # la respuesta, sin un parse+serialize de ida y vuelta en Python.
+        body = (
+            b'{"source":"cache",'
+            b'"message":"Datos recuperados de la base de datos local (Cache Hit).",'
+            b'"query":' + orjson.dumps({"make": make, "model": model, "year": year_str}) +
+            b',"data":' + cached_data.encode() + b'}'
+        )
+        return cached_body_response(body)
+    else:
+        # 2. Encolar la llamada a Apify y responder de inmediato (202)
+        job_id = enqueue_apify_job(cache_key, make, model, year_str)
+        return json_response({
+            "source": "apify_api",
+            "message": "Cache Miss: la consulta a Apify se está procesando en segundo plano.",
             "query": {"make": make, "model": model, "year": year_str},
-            "data": cached_data
+            "job_id": job_id,
+            "status_url": f"/vehicle-data/status/{quote(job_id, safe='')}"
+        }, 202)
+
+@app.route('/vehicle-data/batch', methods=['GET'])
+def get_vehicle_data_batch():
+    """
+    Endpoint: /vehicle-data/batch?queries=AUDI:A4:2020,BMW:320:2021
+    Resuelve N vehículos con un solo round-trip a la base de datos.
+    """
+    queries_str = request.args.get('queries')
+    if not queries_str:
+        return json_response({"error": "Falta el parámetro 'queries'. Formato: MARCA:MODELO:AÑO separados por comas."}, 400)
+
+    raw_queries = queries_str.split(',')
+    # Cada miss dispara una ejecución (de pago) del Actor de Apify: un lote
+    # sin límite permitiría abanicar miles de ejecuciones con un solo request.
+    if len(raw_queries) > MAX_BATCH_QUERIES:
+        return json_response({"error": f"Demasiadas consultas: máximo {MAX_BATCH_QUERIES} por lote."}, 400)
+
+    queries = {}
+    for raw in raw_queries:
+        parts = raw.split(':')
+        if len(parts) != 3:
+            return json_response({"error": f"Consulta inválida: '{raw}'. Formato esperado: MARCA:MODELO:AÑO."}, 400)
+        try:
+            q = VehicleQuery.model_validate(
+                {"make": parts[0], "model": parts[1], "year": parts[2]}
+            )
+        except ValidationError:
+            return json_response({"error": f"Consulta inválida: '{raw}'. Formato esperado: MARCA:MODELO:AÑO."}, 400)
+        queries[key_of(q.make, q.model, q.year)] = (q.make, q.model, str(q.year))
+
+    # Un solo SELECT para todos los hits; los misses se encolan en Apify
+    hits = check_cache_many(list(queries))
+    pending = {
+        key: enqueue_apify_job(key, *query)
+        for key, query in queries.items() if key not in hits
+    }
+
+    # Igual que en el hit individual: el JSON cacheado se incrusta tal cual
+    results = b','.join(
+        orjson.dumps(key) + b':' + data_text.encode()
+        for key, data_text in hits.items()
+    )
+    body = (b'{"source":"cache","results":{' + results +
+            b'},"pending":' + orjson.dumps(pending) + b'}')
+    return cached_body_response(body)
+
+@app.route('/vehicle-data/status/<job_id>', methods=['GET'])
+def get_job_status(job_id):
+    """Consulta el estado de un trabajo de Apify encolado por un Cache Miss."""
+    # TTLCache no es thread-safe: la lectura también va bajo el lock, igual
+    # que las inserciones de enqueue_apify_job
+    with _jobs_lock:
+        job = _jobs.get(job_id)
+    if job is None:
+        # El job pudo encolarse en otro worker de gunicorn: como el job_id es
+        # la cache_key, la caché compartida resuelve el estado desde cualquier
+        # proceso.
+        cached_data = check_cache(job_id)
+        if cached_data:
+            body = (
+                b'{"status":"done","source":"cache",'
+                b'"message":' +
+                orjson.dumps("Datos recuperados y guardados en caché (Cache Miss).") +
+                b',"data":' + cached_data.encode() + b'}'
+            )
+            return cached_body_response(body)
+        # Sin Future local ni entrada en caché no se puede distinguir un job
+        # en curso en otro worker de un job_id desconocido: se responde
+        # pending y el cliente decide cuándo dejar de sondear.
+        return json_response({"status": "pending", "job_id": job_id}, 202)
+
+    if not job.done():
+        return json_response({"status": "pending", "job_id": job_id}, 202)
+
+    api_data = job.result()
+
+    if api_data is None:
+        return json_response({"status": "error", "message": "Error al comunicarse con la API de Apify. Revisa logs."}, 503)
+
+    if api_data:
+        return json_response({
+            "status": "done",
+            "source": "apify_api",
+            "message": "Datos recuperados y guardados en caché (Cache Miss).",
+            "data": api_data
         })
     else:
-        # 2. Llamar a la API de Apify
-        api_data = call_apify_api(make, model, year_str)
-
-        if api_data is None:
-            return jsonify({"source": "apify_api", "message": "Error al comunicarse con la API de Apify. Revisa logs."}), 503
-        
-        if api_data:
-            # 3. Éxito de la API: Guardar en caché y retornar
-            save_to_cache(cache_key, api_data)
-            return jsonify({
-                "source": "apify_api",
-                "message": "Datos recuperados y guardados en caché (Cache Miss).",
-                "query": {"make": make, "model": model, "year": year_str},
-                "data": api_data
-            })
-        else:
-            # 4. No hay datos
-            return jsonify({
-                "source": "apify_api", 
-                "message": "Consulta exitosa en la API, pero no se encontraron datos de vehículo para la combinación especificada."
-            }), 404
+        return json_response({
+            "status": "done",
+            "source": "apify_api",
+            "message": "Consulta exitosa en la API, pero no se encontraron datos de vehículo para la combinación especificada."
+        }, 404)
 
 if __name__ == '__main__':
-    app.run(debug=True, host='0.0.0.0', port=5000)
+    # Solo para desarrollo local. En producción se sirve con gunicorn
+    # (ver Dockerfile); debug=True desactiva optimizaciones y retiene
+    # tracebacks por request, así que nunca en producción.
+    app.run(host='0.0.0.0', port=5000)
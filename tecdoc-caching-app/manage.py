@@ -0,0 +1,19 @@
+"""Comandos de administración de la app de caching.
+
+Uso:
+    python manage.py migrate   # crea/actualiza el esquema del backend activo
+"""
+import sys
+
+def main():
+    if len(sys.argv) != 2 or sys.argv[1] != "migrate":
+        print(__doc__.strip())
+        return 1
+
+    # Importar aquí para no pagar el arranque de la app en el --help
+    from app import initialize_db
+    initialize_db()
+    return 0
+
+if __name__ == "__main__":
+    raise SystemExit(main())